@@ -0,0 +1,297 @@
+### Copyright [2019] Zhiyao Ma
+""" Compare the detection engines on a corpus of traces.
+
+Every trace is run through the reference engine, i.e. the sequential
+driver without any optimisation, and through every other engine. The
+detection records each engine prints are diffed record by record against
+those of the reference, and the running time and peak memory of each
+engine are summarised in a table. Every engine is also run with
+`--timeout`, and compared against the reference run with the same
+timeout. The records of the reference runs are in turn checked against
+the expected ones in `golden/`, where a trace `NAME.txt` has its
+records in `NAME.out`, and in `NAME.timeout-SECONDS.out` with
+`--timeout SECONDS`. Traces without such a file are not checked. With
+`--reference-rev REV`, the reference run without timeout uses the
+`event_parser.py` of the git revision REV instead, e.g. the baseline
+tree, so every optimisation is checked against the code it replaced.
+
+With `--startup`, the per-invocation overhead of each engine is measured
+instead, on an empty trace: the wall time of the whole run and the
+import time reported by `python -X importtime`. Every engine passes at
+least one flag, so all of them go through the same command line handling.
+The bare invocation without any argument, which skips it, is measured
+separately, and so is that of `--baseline REV` if given.
+
+Usage: python compare_engines.py [--engine NAME=FLAGS ...]
+                                 [--reference-rev REV] TRACE_OR_DIR ...
+       python compare_engines.py [--engine NAME=FLAGS ...] --startup
+                                 [--baseline REV]
+"""
+import io
+import os
+import sys
+import time
+import shlex
+import tarfile
+import argparse
+import tempfile
+import subprocess
+from itertools import zip_longest
+
+EVENT_PARSER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'event_parser.py')
+GOLDEN = os.path.join(os.path.dirname(EVENT_PARSER), 'golden')
+
+REFERENCE = ('reference', ['--no-prefilter'])
+
+ENGINES = [
+    ('prefilter', ['--prefilter']),
+    ('field-cache', ['--field-cache', '4096']),
+    ('pipeline', ['--pipeline']),
+]
+
+def list_traces(paths):
+    """ Expand `paths` into a sorted list of trace files. """
+    traces = []
+    for path in paths:
+        if os.path.isdir(path):
+            traces.extend(sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names))
+        else:
+            traces.append(path)
+    return traces
+
+def count_lines(trace):
+    with open(trace, 'rb') as f:
+        return sum(1 for _ in f)
+
+def run_engine(flags, trace, event_parser=EVENT_PARSER):
+    """ Run `event_parser` with `flags` on `trace`.
+
+    Return the detection records, the exit status, the elapsed wall time
+    in seconds, the peak resident memory in kilobytes and what was
+    printed to stderr. The memory is that of the largest single process,
+    not the sum over the processes of a pipeline.
+    """
+    # stderr goes to a file rather than a pipe, which could fill up while
+    # stdout is being read.
+    with open(trace, 'rb') as f, tempfile.TemporaryFile() as errors:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, event_parser] + flags,
+                                   stdin=f, stdout=subprocess.PIPE,
+                                   stderr=errors)
+        output = process.stdout.read()
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        process.stdout.close()
+        errors.seek(0)
+        stderr = errors.read().decode(errors='replace')
+    records = output.decode(errors='replace').splitlines()
+    return records, process.returncode, elapsed, rusage.ru_maxrss, stderr
+
+def measure_startup(flags, repeat, event_parser=EVENT_PARSER):
+    """ Run `event_parser` with `flags` on an empty trace `repeat` times.
+
+    Return the best wall time and the best total import time, both in
+    milliseconds.
+    """
+    best_wall = best_import = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', event_parser] + flags,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+
+        # Sum the cumulative time of the top-level imports only, i.e. those
+        # not indented below another import.
+        import_us = 0
+        for line in result.stderr.decode(errors='replace').splitlines():
+            if not line.startswith('import time:'):
+                continue
+            fields = line.split('|')
+            if fields[2].startswith('  ') or not fields[1].strip().isdigit():
+                continue
+            import_us += int(fields[1])
+
+        best_wall = min(best_wall, elapsed * 1000)
+        best_import = min(best_import, import_us / 1000)
+    return best_wall, best_import
+
+def checkout(rev, directory):
+    """ Extract the tree of git revision `rev` into `directory`. """
+    tree = subprocess.run(['git', 'archive', '--format=tar', rev],
+                          cwd=os.path.dirname(EVENT_PARSER),
+                          stdout=subprocess.PIPE, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(tree)) as f:
+        f.extractall(directory)
+    return os.path.join(directory, 'event_parser.py')
+
+def read_golden(golden, trace, suffix):
+    """ Return the expected records of `trace`, or None if there are none.
+
+    They are read from the file named after `trace` in the `golden`
+    directory, with its extension replaced by `suffix` followed by `.out`.
+    """
+    name = os.path.splitext(os.path.basename(trace))[0]
+    path = os.path.join(golden, name + suffix + '.out')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().splitlines()
+
+def diff_records(expected, actual):
+    """ Return the number of differing records and the first difference. """
+    mismatches = 0
+    first = None
+    for i, (e, a) in enumerate(zip_longest(expected, actual)):
+        if e != a:
+            mismatches += 1
+            if first is None:
+                first = (i + 1, e, a)
+    return mismatches, first
+
+def compare(traces, runs, golden):
+    """ Run every run of `runs` on every trace of `traces`.
+
+    Each run is a `(name, event_parser, flags, reference, suffix)` tuple.
+    Its records are compared against those of the run named `reference`,
+    which comes before it, or against the golden records with `suffix` in
+    `golden` if it is the reference itself. Return the number of lines of
+    the traces and the statistics of each run by name.
+    """
+    total_lines = 0
+    stats = { name : {'mismatches' : 0, 'failures' : 0,
+                      'seconds' : 0.0, 'peak_kb' : 0}
+              for name, _, _, _, _ in runs }
+    for trace in traces:
+        total_lines += count_lines(trace)
+        expected = {}
+        for name, event_parser, flags, reference, suffix in runs:
+            records, returncode, elapsed, peak_kb, stderr = \
+                run_engine(flags, trace, event_parser)
+            stat = stats[name]
+            stat['seconds'] += elapsed
+            stat['peak_kb'] = max(stat['peak_kb'], peak_kb)
+            if returncode != 0:
+                stat['failures'] += 1
+                print('%s: %s exited with status %d'
+                      % (trace, name, returncode), file=sys.stderr)
+                for line in stderr.splitlines()[-20:]:
+                    print('  %s' % line, file=sys.stderr)
+            if name == reference:
+                expected[name] = records
+                golden_records = read_golden(golden, trace, suffix)
+                if golden_records is None:
+                    continue
+                mismatches, first = diff_records(golden_records, records)
+            else:
+                mismatches, first = diff_records(expected[reference], records)
+            stat['mismatches'] += mismatches
+            if first is not None:
+                print('%s: %s differs in %d records, first at record %d'
+                      % (trace, name, mismatches, first[0]), file=sys.stderr)
+                print('  expected: %s' % first[1], file=sys.stderr)
+                print('  actual:   %s' % first[2], file=sys.stderr)
+    return total_lines, stats
+
+def parse_engine(arg):
+    """ Parse a `NAME=FLAGS` command line argument. """
+    name, sep, flags = arg.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError('expected NAME=FLAGS, got %r' % arg)
+    return name, shlex.split(flags)
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Compare the output and speed of the detection engines.')
+    arg_parser.add_argument('traces', nargs='*', metavar='TRACE_OR_DIR',
+                            help='trace files, or directories of them')
+    arg_parser.add_argument('--engine', type=parse_engine, action='append',
+                            metavar='NAME=FLAGS',
+                            help='compare the engine run with the given'
+                                 ' event_parser.py flags instead of the'
+                                 ' default ones; can be repeated')
+    arg_parser.add_argument('--startup', action='store_true',
+                            help='measure the per-invocation overhead of'
+                                 ' each engine instead')
+    arg_parser.add_argument('--baseline', metavar='REV',
+                            help='with --startup, also measure the bare'
+                                 ' invocation of the git revision REV')
+    arg_parser.add_argument('--repeat', type=int, default=20,
+                            help='runs per engine with --startup, the best'
+                                 ' one is reported (default: 20)')
+    arg_parser.add_argument('--timeout', type=float, default=5,
+                            metavar='SECONDS',
+                            help='also compare every engine run with'
+                                 ' `--timeout SECONDS`, 0 to skip'
+                                 ' (default: 5)')
+    arg_parser.add_argument('--golden', default=GOLDEN, metavar='DIR',
+                            help='directory of the expected records of the'
+                                 ' reference runs (default: golden/ next to'
+                                 ' this script)')
+    arg_parser.add_argument('--reference-rev', metavar='REV',
+                            help='run the reference without timeout with the'
+                                 ' event_parser.py of the git revision REV,'
+                                 ' e.g. the baseline')
+    args = arg_parser.parse_args()
+    engines = [REFERENCE] + (args.engine or ENGINES)
+
+    if args.startup:
+        print('%-20s %10s %10s' % ('engine', 'wall ms', 'import ms'))
+        for name, flags in engines + [('bare', [])]:
+            print('%-20s %10.1f %10.1f'
+                  % ((name,) + measure_startup(flags, args.repeat)))
+        if args.baseline:
+            with tempfile.TemporaryDirectory() as directory:
+                event_parser = checkout(args.baseline, directory)
+                print('%-20s %10.1f %10.1f'
+                      % (('bare@' + args.baseline,)
+                         + measure_startup([], args.repeat, event_parser)))
+        return
+
+    traces = list_traces(args.traces)
+    if not traces:
+        arg_parser.error('no traces found')
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Each run is compared against the reference run with the same
+        # timeout, and the reference runs against the golden records with
+        # that suffix. An older revision knows none of the flags, nor
+        # `--timeout`, so only the run without timeout can use it.
+        reference = (REFERENCE[0], EVENT_PARSER, REFERENCE[1])
+        if args.reference_rev:
+            reference = ('reference@' + args.reference_rev,
+                         checkout(args.reference_rev, directory), [])
+        runs = [reference + (reference[0], '')]
+        runs += [(name, EVENT_PARSER, flags, reference[0], '')
+                 for name, flags in engines[1:]]
+        if args.timeout:
+            timeout = ['--timeout', '%g' % args.timeout]
+            runs += [(name + '+timeout', EVENT_PARSER, flags + timeout,
+                      REFERENCE[0] + '+timeout', '.timeout-%g' % args.timeout)
+                     for name, flags in engines]
+        total_lines, stats = compare(traces, runs, args.golden)
+
+    print('%d traces, %d lines' % (len(traces), total_lines))
+    print('%-20s %10s %8s %10s %12s %12s'
+          % ('engine', 'mismatches', 'failures', 'seconds', 'lines/s',
+             'max RSS MB*'))
+    for name, _, _, _, _ in runs:
+        stat = stats[name]
+        print('%-20s %10d %8d %10.3f %12.0f %12.1f'
+              % (name, stat['mismatches'], stat['failures'], stat['seconds'],
+                 total_lines / stat['seconds'] if stat['seconds'] else 0,
+                 stat['peak_kb'] / 1024))
+    print('* of the largest single process, not summed over the processes'
+          ' of a pipeline')
+
+    if any(stat['mismatches'] or stat['failures'] for stat in stats.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
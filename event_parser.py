@@ -1,57 +1,153 @@
 ### Copyright [2019] Zhiyao Ma
 import sys
-import inspect
-
-from parsers.ParserBase import ParserBase
-from parsers.HandoverSuccessParser import HandoverSuccessParser
-from parsers.HandoverFailureParser import HandoverFailureParser
-from parsers.FastRecoverAfterRLFParser import FastRecoverAfterRLFParser
-from parsers.SlowRecoverAfterRLFParser import SlowRecoverAfterRLF
-
-def extract_info(line):
-    timestamp, pkt_type, fields = (i.strip() for i in line.split("$"))
-    fields = { i.split(':')[0].strip() : ':'.join(i.split(':')[1:]).strip()
-               for i in fields.split(',')
-               if i.strip() != '' }
-    return timestamp, pkt_type, fields
-
-def run():
-    shared_states = {
-        'last_serving_cell_dl_freq' : None,
-        'last_serving_cell_ul_freq' : None,
-        'last_serving_cell_id' : None,
-        'last_serving_cell_identity' : 'unknown',
-        'reset_all' : False,
-        'stall_once' : False
-    }
-    active_parsers = [
-        i(shared_states) for i in globals().values()
-        if inspect.isclass(i)
-        and issubclass(i, ParserBase)
-        and i is not ParserBase
-    ]
-
-    line_num = 0
+
+from events import PARSER_CLASSES, PACKET_TYPES, extract_info,\
+                   make_cached_extract_info, prefiltered_lines,\
+                   make_shared_states, make_parsers, make_expirer, feed
+
+def input_lines(prefilter, pkt_types, metrics=None):
+    """ Yield the lines on stdin, prefiltered by `pkt_types` if requested.
+
+    If `metrics` is given, every raw line read is accounted to it.
+    """
+    if prefilter or metrics is not None:
+        stream = sys.stdin.buffer
+        if metrics is not None:
+            stream = metrics.counted(stream)
+        if prefilter:
+            yield from prefiltered_lines(stream, pkt_types, sys.stdin.encoding)
+        else:
+            for line in stream:
+                yield line.decode(sys.stdin.encoding)
+        return
     while True:
         try:
-            if not shared_states['stall_once']:
-                line = input()
-                line_num += 1
-            else:
-                shared_states['stall_once'] = False
-
-            if shared_states['reset_all']:
-                for active_parser in active_parsers:
-                    active_parser.reset()
-                shared_states['reset_all'] = False
-            for active_parser in active_parsers:
-                active_parser.run(extract_info(line))
+            yield input()
         except EOFError:
-            break
-        # except Exception as e:
-            # print('Exception at line', line_num)
-            # print(e)
-            # sys.exit(1)
+            return
+
+def run(prefilter=True, metrics_file=None, metrics_interval=10,
+        timeouts=None, field_cache=0):
+    """ Run all parsers on the trace read from stdin.
+
+    If `prefilter` is set, lines of packet types that no parser takes
+    actions on are dropped before being decoded. If `metrics_file` is
+    given, runtime metrics are written to it in Prometheus text format
+    every `metrics_interval` seconds. `timeouts` maps parser class names
+    to the seconds of event time after which a half-finished detection is
+    given up. If `field_cache` is positive, up to that many field
+    dictionaries of recent events are memoized, and the cache statistics
+    are printed to stderr at exit.
+    """
+    shared_states = make_shared_states()
+    active_parsers = make_parsers(shared_states)
+    expirer = make_expirer(active_parsers, shared_states, timeouts)
+
+    extract = extract_info
+    if field_cache > 0:
+        extract, cache_info = make_cached_extract_info(field_cache)
+
+    metrics = None
+    if metrics_file is not None:
+        from metrics import Metrics
+        metrics = Metrics(metrics_file, metrics_interval,
+                          active_parsers, shared_states)
+    try:
+        for line in input_lines(prefilter, PACKET_TYPES, metrics):
+            feed(active_parsers, shared_states, extract(line), expirer)
+        if expirer is not None:
+            expirer.flush()
+    finally:
+        if metrics is not None:
+            metrics.close()
+        if field_cache > 0:
+            info = cache_info()
+            print('Field cache: %d hits, %d misses, %d/%d entries'
+                  % (info.hits, info.misses, info.currsize, info.maxsize),
+                  file=sys.stderr)
+
+def parse_count(arg):
+    """ Parse a positive integer command line argument. """
+    count = int(arg)
+    if count <= 0:
+        raise ValueError('%r is not positive' % arg)
+    return count
+
+def parse_timeout(arg):
+    """ Parse a `[PARSER=]SECONDS` command line argument. """
+    name, _, seconds = arg.rpartition('=')
+    seconds = float(seconds)
+    if not seconds >= 0:
+        raise ValueError('%r is negative' % arg)
+    return name or None, seconds
+
+def main():
+    """ Parse the command line and run the parsers accordingly. """
+    import argparse
+    arg_parser = argparse.ArgumentParser(
+        description='Detect LTE mobility events from a trace read on stdin.')
+    arg_parser.add_argument('--pipeline', action='store_true',
+                            help='decode lines in parallel processes, and'
+                                 ' run the parsers in the main process')
+    arg_parser.add_argument('--workers', type=parse_count, default=None,
+                            help='decoder processes in pipeline mode'
+                                 ' (default: one per core)')
+    arg_parser.add_argument('--chunk-size', type=parse_count, default=1 << 20,
+                            metavar='BYTES',
+                            help='bytes of input decoded at a time in'
+                                 ' pipeline mode (default: 1048576)')
+    arg_parser.add_argument('--prefilter', default=True,
+                            action=argparse.BooleanOptionalAction,
+                            help='drop lines of packet types no parser takes'
+                                 ' actions on before decoding them'
+                                 ' (default: on)')
+    arg_parser.add_argument('--metrics-file', metavar='PATH',
+                            help='periodically rewrite PATH with runtime'
+                                 ' metrics in Prometheus text format')
+    arg_parser.add_argument('--metrics-interval', type=float, default=10,
+                            metavar='SECONDS',
+                            help='seconds between two metrics updates'
+                                 ' (default: 10)')
+    arg_parser.add_argument('--timeout', type=parse_timeout, action='append',
+                            default=[], metavar='[PARSER=]SECONDS',
+                            help='give up a detection of PARSER, or of every'
+                                 ' parser, which is still unfinished after'
+                                 ' SECONDS of event time; can be repeated')
+    arg_parser.add_argument('--field-cache', type=int, default=0,
+                            metavar='SIZE',
+                            help='memoize the fields of up to SIZE distinct'
+                                 ' recent payloads (default: 0, disabled)')
+    args = arg_parser.parse_args()
+    if args.pipeline and args.field_cache > 0:
+        arg_parser.error('--field-cache is not supported in pipeline mode')
+
+    parser_names = [i.__name__ for i in PARSER_CLASSES]
+    timeouts = {}
+    for name, seconds in args.timeout:
+        if name is None:
+            timeouts.update({i : seconds for i in parser_names
+                             if i not in timeouts})
+        elif name in parser_names:
+            timeouts[name] = seconds
+        else:
+            arg_parser.error('unknown parser %s, choose from %s'
+                             % (name, ', '.join(parser_names)))
+
+    if args.pipeline:
+        from pipeline import run_pipeline
+        run_pipeline(prefilter=args.prefilter, workers=args.workers,
+                     chunk_size=args.chunk_size, timeouts=timeouts,
+                     metrics_file=args.metrics_file,
+                     metrics_interval=args.metrics_interval)
+    else:
+        run(prefilter=args.prefilter, metrics_file=args.metrics_file,
+            metrics_interval=args.metrics_interval, timeouts=timeouts,
+            field_cache=args.field_cache)
 
 if __name__ == '__main__':
-    run()
+    # Skip the argument parser on a bare invocation, which is the common
+    # case when many short traces are processed one by one.
+    if len(sys.argv) == 1:
+        run()
+    else:
+        main()
@@ -0,0 +1,117 @@
+### Copyright [2019] Zhiyao Ma
+""" Decoding of trace lines into events, and feeding of events to the parsers.
+
+Shared by the sequential driver in `event_parser.py` and the pipeline
+driver in `pipeline.py`.
+"""
+from parsers.HandoverSuccessParser import HandoverSuccessParser
+from parsers.HandoverFailureParser import HandoverFailureParser
+from parsers.FastRecoverAfterRLFParser import FastRecoverAfterRLFParser
+from parsers.SlowRecoverAfterRLFParser import SlowRecoverAfterRLF
+
+# The parsers run on every event, in this order.
+PARSER_CLASSES = (
+    HandoverSuccessParser,
+    HandoverFailureParser,
+    FastRecoverAfterRLFParser,
+    SlowRecoverAfterRLF
+)
+
+# The packet types that at least one parser takes actions on.
+PACKET_TYPES = frozenset().union(*(i.packet_types() for i in PARSER_CLASSES))
+
+def parse_fields(fields):
+    return { i.split(':')[0].strip() : ':'.join(i.split(':')[1:]).strip()
+             for i in fields.split(',')
+             if i.strip() != '' }
+
+def extract_info(line):
+    timestamp, pkt_type, fields = (i.strip() for i in line.split("$"))
+    return timestamp, pkt_type, parse_fields(fields)
+
+def make_cached_extract_info(maxsize):
+    """ Return an `extract_info` memoizing the fields of the last events.
+
+    Up to `maxsize` field dictionaries are kept, keyed on the packet type
+    and the raw fields. They are shared between events and therefore
+    returned read-only. The `cache_info` function of the cache is returned
+    alongside.
+    """
+    import functools
+    from types import MappingProxyType
+
+    @functools.lru_cache(maxsize=maxsize)
+    def cached_fields(pkt_type, fields):
+        return MappingProxyType(parse_fields(fields))
+
+    def cached_extract_info(line):
+        timestamp, pkt_type, fields = (i.strip() for i in line.split("$"))
+        return timestamp, pkt_type, cached_fields(pkt_type, fields)
+
+    return cached_extract_info, cached_fields.cache_info
+
+def prefiltered_lines(stream, pkt_types, encoding):
+    """ Yield the decoded lines of `stream` whose packet type is in `pkt_types`.
+
+    `stream` yields raw bytes lines. The packet type token between the first
+    two `$` separators is compared against `pkt_types` before the line is
+    decoded or split, so lines no parser cares about are dropped cheaply.
+    Lines without two `$` separators are passed through, so that
+    `extract_info` still fails on them. Lines of other packet types are
+    not checked any further, e.g. for a third `$`.
+    """
+    pkt_tokens = frozenset(i.encode(encoding) for i in pkt_types)
+    for line in stream:
+        first = line.find(b'$')
+        second = line.find(b'$', first + 1)
+        if second < 0 or line[first + 1 : second].strip() in pkt_tokens:
+            yield line.decode(encoding)
+
+def make_shared_states():
+    """ Create the `shared_states` dictionary handed to every parser. """
+    return {
+        'last_serving_cell_dl_freq' : None,
+        'last_serving_cell_ul_freq' : None,
+        'last_serving_cell_id' : None,
+        'last_serving_cell_identity' : 'unknown',
+        'reset_all' : False,
+        'reset_all_count' : 0,
+        'stall_once' : False
+    }
+
+def make_parsers(shared_states):
+    """ Instantiate every parser in `PARSER_CLASSES`. """
+    return [i(shared_states) for i in PARSER_CLASSES]
+
+def feed(active_parsers, shared_states, event, expirer=None):
+    """ Feed one event to all parsers.
+
+    A pending `reset_all` request is served before the event is handed
+    out. If any parser sets `stall_once`, the same event is fed again.
+    If `expirer` is given, parsers in progress for too long are reset
+    before the event is handed out. Only events of `PACKET_TYPES` move the
+    expirer's clock, so that its output does not depend on prefiltering.
+    """
+    timed = expirer is not None and event[1] in PACKET_TYPES
+    if timed:
+        expirer.expire(event[0])
+    while True:
+        if shared_states['reset_all']:
+            for active_parser in active_parsers:
+                active_parser.reset()
+            shared_states['reset_all'] = False
+            shared_states['reset_all_count'] += 1
+        for active_parser in active_parsers:
+            active_parser.run(event)
+        if not shared_states['stall_once']:
+            break
+        shared_states['stall_once'] = False
+    if timed:
+        expirer.arm(event[0])
+
+def make_expirer(active_parsers, shared_states, timeouts):
+    """ Return a `StateExpirer` for `timeouts`, or None if there are none. """
+    if not timeouts:
+        return None
+    from timer_wheel import StateExpirer
+    return StateExpirer(active_parsers, shared_states, timeouts)
@@ -0,0 +1,202 @@
+### Copyright [2019] Zhiyao Ma
+""" Runtime metrics for long-running parses.
+
+The metrics are written to a file in Prometheus text format, which can be
+picked up by the node exporter textfile collector or simply watched. The
+file is written when the parse starts, then rewritten atomically every
+`interval` seconds by a background thread, whether lines arrive or not.
+The reading loop only bumps two counters per line, or per chunk in
+pipeline mode.
+"""
+import os
+import re
+import sys
+import time
+import threading
+
+from timer_wheel import parse_timestamp
+
+_ANSI_ESCAPE = re.compile('\u001b\\[[0-9;]*m')
+_WARNING = re.compile(r'Warning \[(\w+)\] \[[^\]]*\]: (.*)')
+
+def _escape(value):
+    """ Escape a Prometheus label value. """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+                     .replace('\n', '\\n')
+
+class _CountingStream:
+    """ A text stream wrapper counting the complete lines written to it.
+
+    Each line is mapped to a label by `classify`, and `counts[label]` is
+    incremented. Lines mapped to None are not counted.
+    """
+
+    def __init__(self, stream, counts, classify):
+        self.stream = stream
+        self.counts = counts
+        self.classify = classify
+        self.pending = ''
+
+    def write(self, text):
+        if '\n' in text:
+            lines = (self.pending + text).split('\n')
+            self.pending = lines.pop()
+            for line in lines:
+                label = self.classify(line)
+                if label is not None:
+                    self.counts[label] = self.counts.get(label, 0) + 1
+        else:
+            self.pending += text
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _classify_detection(line):
+    """ Return the category of a detection report, e.g. `Handover Success`. """
+    category, sep, _ = line.partition(' $')
+    return category.strip() if sep else None
+
+def _classify_warning(line):
+    """ Return `(parser, message)` of a warning printed by a parser. """
+    match = _WARNING.search(_ANSI_ESCAPE.sub('', line))
+    return match.groups() if match else None
+
+class Metrics:
+    """ Collect runtime metrics and periodically write them to `path`.
+
+    Detections and warnings are counted by wrapping `sys.stdout` and
+    `sys.stderr` until `close` is called. The file is rewritten by a
+    daemon thread, which only reads the counters.
+    """
+
+    def __init__(self, path, interval, active_parsers, shared_states):
+        self.path = path
+        self.interval = interval
+        self.active_parsers = active_parsers
+        self.shared_states = shared_states
+
+        self.lines_read = 0
+        self.bytes_read = 0
+        self.last_line = None
+        self.detections = {}
+        self.warnings = {}
+
+        self.start_time = time.monotonic()
+        self.last_write_time = self.start_time
+        self.last_write_lines = 0
+        self.lines_per_second = 0.0
+
+        self.stdout = sys.stdout
+        self.stderr = sys.stderr
+        sys.stdout = _CountingStream(sys.stdout, self.detections,
+                                     _classify_detection)
+        sys.stderr = _CountingStream(sys.stderr, self.warnings,
+                                     _classify_warning)
+
+        self.write()
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self._write_periodically,
+                                       daemon=True)
+        self.writer.start()
+
+    def _write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def counted(self, stream):
+        """ Yield the raw lines of `stream`, accounting each of them. """
+        for line in stream:
+            self.lines_read += 1
+            self.bytes_read += len(line)
+            self.last_line = line
+            yield line
+
+    def count_chunk(self, chunk):
+        """ Account a chunk of whole raw lines, as read by the pipeline. """
+        self.lines_read += chunk.count(b'\n') + (not chunk.endswith(b'\n'))
+        self.bytes_read += len(chunk)
+        self.last_line = chunk[chunk.rfind(b'\n', 0, -1) + 1:]
+
+    def close(self):
+        """ Restore the standard streams and write the final metrics. """
+        self.stopped.set()
+        self.writer.join()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+        self.write()
+
+    def _parser_states(self):
+        """ Yield `(parser, flag, value)` for every boolean parser flag. """
+        for active_parser in self.active_parsers:
+            # Copy first, the parsers keep running in the main thread.
+            for flag, value in sorted(dict(vars(active_parser)).items()):
+                if isinstance(value, bool):
+                    yield active_parser.__class__.__name__, flag, int(value)
+
+    def write(self):
+        """ Rewrite the metrics file with the current values. """
+        now = time.monotonic()
+        lines_read = self.lines_read
+        if now > self.last_write_time:
+            self.lines_per_second = (lines_read - self.last_write_lines)\
+                                    / (now - self.last_write_time)
+        self.last_write_time = now
+        self.last_write_lines = lines_read
+
+        out = []
+        def metric(name, kind, help, samples):
+            out.append('# HELP lte_parser_%s %s' % (name, help))
+            out.append('# TYPE lte_parser_%s %s' % (name, kind))
+            for labels, value in samples:
+                labels = ','.join('%s="%s"' % (k, _escape(v))
+                                  for k, v in labels)
+                out.append('lte_parser_%s%s %s'
+                           % (name, '{%s}' % labels if labels else '', value))
+
+        metric('lines_read_total', 'counter',
+               'Lines read from the trace.', [((), lines_read)])
+        metric('bytes_read_total', 'counter',
+               'Bytes read from the trace.', [((), self.bytes_read)])
+        metric('lines_per_second', 'gauge',
+               'Lines read per second since the previous update.',
+               [((), '%.1f' % self.lines_per_second)])
+        metric('uptime_seconds', 'gauge',
+               'Seconds since the parse started.',
+               [((), '%.3f' % (now - self.start_time))])
+        metric('updated_timestamp_seconds', 'gauge',
+               'Wall clock time of this update.',
+               [((), '%.3f' % time.time())])
+
+        event_time = None
+        last_line = self.last_line
+        if last_line is not None:
+            event_time = parse_timestamp(
+                last_line.split(b'$', 1)[0].decode(errors='replace').strip())
+        if event_time is not None:
+            metric('event_lag_seconds', 'gauge',
+                   'Wall clock time minus the latest event timestamp.',
+                   [((), '%.3f' % (time.time() - event_time))])
+
+        metric('detections_total', 'counter',
+               'Detection reports per category.',
+               [((('category', k),), v)
+                for k, v in sorted(dict(self.detections).items())])
+        metric('warnings_total', 'counter',
+               'Warnings per parser and kind.',
+               [((('parser', k[0]), ('kind', k[1])), v)
+                for k, v in sorted(dict(self.warnings).items())])
+        metric('reset_all_total', 'counter',
+               'Times all parsers were reset.',
+               [((), self.shared_states['reset_all_count'])])
+        metric('parser_state', 'gauge',
+               'Boolean state flags of each parser.',
+               [((('parser', p), ('flag', f)), v)
+                for p, f, v in self._parser_states()])
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(out) + '\n')
+        os.replace(tmp_path, self.path)
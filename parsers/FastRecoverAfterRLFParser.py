@@ -121,3 +121,10 @@ class FastRecoverAfterRLFParser(ParserBase):
     
     def reset(self):
         self.reset_to_normal_state()
+
+    @classmethod
+    def packet_types(cls):
+        return frozenset(cls.action_to_events)
+
+    def in_progress(self):
+        return self.reestablishment_requested_on_rlf
@@ -238,3 +238,12 @@ class HandoverSuccessParser(ParserBase):
     def reset(self):
         """ Reset the states of the parser. """
         self._reset_to_normal_state()
+
+    @classmethod
+    def packet_types(cls):
+        """ Return the set of packet types the parser takes actions on. """
+        return frozenset(cls._action_to_events)
+
+    def in_progress(self):
+        """ Tell whether the parser is in the middle of detecting an event. """
+        return self.received_handover_command
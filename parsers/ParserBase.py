@@ -34,6 +34,23 @@ class ParserBase(ABC):
         """ Reset the states of the parser. """
         pass
 
+    def in_progress(self):
+        """ Tell whether the parser is in the middle of detecting an event.
+
+        A parser which stays in progress for too long may be reset by the
+        driver, see `timer_wheel.StateExpirer`.
+        """
+        return False
+
+    @classmethod
+    @abstractmethod
+    def packet_types(cls):
+        """ Return the set of packet types the parser takes actions on.
+
+        Events of any other packet type must leave the parser untouched.
+        """
+        pass
+
     @staticmethod
     def eprint(*pargs, **kargs):
         """ Print error messgae to stderr. """
@@ -118,3 +118,11 @@ class SlowRecoverAfterRLF(ParserBase):
     
     def reset(self):
         self.reset_to_normal_state()
+
+    @classmethod
+    def packet_types(cls):
+        return frozenset(cls.action_to_events)
+
+    def in_progress(self):
+        return self.reestablishment_requested_on_rlf\
+        or self.mac_rach_connection_request_reason is not None
@@ -0,0 +1,115 @@
+### Copyright [2019] Zhiyao Ma
+""" Pipeline-parallel driver.
+
+The main process reads stdin in chunks of whole lines, as large as what is
+available up to a limit, and hands them to a pool of decoder processes. Each decoder prefilters its chunk, parses
+the matching lines into events, and sends them back marshalled. The main
+process feeds the events to the parsers in input order.
+
+Decoding (prefiltering, splitting and field parsing) is the bulk of the
+work, and it is independent from line to line, so it is spread over as many
+cores as there are decoders. All parsers stay in the main process. They
+read each other's writes to `shared_states` (`last_serving_cell_*`,
+`reset_all`, `stall_once`) within the very same event, so splitting them
+across processes would need a barrier per event. Keeping them together
+makes the output identical to the sequential run by construction.
+"""
+import os
+import sys
+import marshal
+import select
+import multiprocessing
+from collections import deque
+
+from events import extract_info, prefiltered_lines, make_shared_states,\
+                   make_parsers, make_expirer, feed, PACKET_TYPES
+
+def _ready(stream):
+    """ Tell whether reading `stream` would return without blocking. """
+    return bool(select.select([stream], [], [], 0)[0])
+
+def _chunks(stream, chunk_size):
+    """ Yield chunks of up to `chunk_size` bytes of whole lines of `stream`.
+
+    Whatever is available is read at once, so lines of a live feed are
+    yielded as soon as they arrive. None is yielded whenever the next read
+    would block, i.e. the input is idle.
+    """
+    rest = b''
+    while True:
+        if not _ready(stream):
+            yield None
+        chunk = stream.read1(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            rest += chunk
+            continue
+        yield rest + chunk[:end]
+        rest = chunk[end:]
+    if rest:
+        yield rest
+
+def _decode(chunk, prefilter, encoding):
+    """ Decoder process. Return the marshalled events of `chunk`. """
+    lines = chunk.split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    if prefilter:
+        lines = prefiltered_lines(lines, PACKET_TYPES, encoding)
+    else:
+        lines = (i.decode(encoding) for i in lines)
+    return marshal.dumps([extract_info(i) for i in lines])
+
+def run_pipeline(prefilter=True, workers=None, chunk_size=1 << 20,
+                 timeouts=None, metrics_file=None, metrics_interval=10):
+    """ Run the parsers on stdin, decoding lines in parallel processes.
+
+    `prefilter`, `timeouts`, `metrics_file` and `metrics_interval` are
+    handled as in `event_parser.run`. `workers` decoder processes are
+    used, one per core by default, each decoding up to `chunk_size` bytes
+    of input at a time.
+    """
+    workers = workers or os.cpu_count() or 1
+    encoding = sys.stdin.encoding
+    shared_states = make_shared_states()
+    active_parsers = make_parsers(shared_states)
+    expirer = make_expirer(active_parsers, shared_states, timeouts)
+
+    def detect(decoded):
+        for event in marshal.loads(decoded.get()):
+            feed(active_parsers, shared_states, event, expirer)
+
+    # Leaving the `with` block, also on an exception, terminates the pool.
+    with multiprocessing.Pool(workers) as pool:
+        # Started after the pool, so that no decoder is forked while the
+        # metrics thread runs.
+        metrics = None
+        if metrics_file is not None:
+            from metrics import Metrics
+            metrics = Metrics(metrics_file, metrics_interval,
+                              active_parsers, shared_states)
+        try:
+            pending = deque()
+            for chunk in _chunks(sys.stdin.buffer, chunk_size):
+                # Catch up while waiting for input, so that a live feed is
+                # not held back until more chunks fill the pool.
+                if chunk is None:
+                    while pending:
+                        detect(pending.popleft())
+                    sys.stdout.flush()
+                    continue
+                if metrics is not None:
+                    metrics.count_chunk(chunk)
+                pending.append(pool.apply_async(_decode,
+                                                (chunk, prefilter, encoding)))
+                if len(pending) > 2 * workers:
+                    detect(pending.popleft())
+            while pending:
+                detect(pending.popleft())
+            if expirer is not None:
+                expirer.flush()
+        finally:
+            if metrics is not None:
+                metrics.close()
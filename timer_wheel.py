@@ -0,0 +1,167 @@
+### Copyright [2019] Zhiyao Ma
+""" Expiry of parsers stuck in half-finished states.
+
+Time is taken from the event timestamps, not from the wall clock, so a
+trace gives the same output no matter how fast it is replayed.
+"""
+from datetime import datetime
+
+def parse_timestamp(timestamp):
+    """ Convert a trace timestamp to seconds since the epoch.
+
+    Both epoch seconds and ISO 8601 date times (taken as local time) are
+    understood. Return None if `timestamp` is in neither form.
+    """
+    try:
+        return float(timestamp)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except ValueError:
+        return None
+
+def format_timestamp(seconds, like):
+    """ Format `seconds` since the epoch in the same form as `like`.
+
+    ISO 8601 date times keep the time zone, or lack of it, and the date
+    and time separator of `like`.
+    """
+    try:
+        float(like)
+    except ValueError:
+        tzinfo = datetime.fromisoformat(like).tzinfo
+        sep = 'T' if 'T' in like else ' '
+        return datetime.fromtimestamp(seconds, tzinfo).isoformat(sep=sep)
+    return '%.6f' % seconds
+
+class TimerWheel:
+    """ A hashed timer wheel driven by event time.
+
+    Timers are put into one of `slots` buckets by their deadline, each
+    bucket spanning `resolution` seconds. Advancing the wheel only looks
+    at the buckets passed since the previous advance, and at most one full
+    turn of the wheel however large the gap between two events is.
+    """
+
+    def __init__(self, resolution=1.0, slots=256):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        self.current_tick = None
+
+    def schedule(self, deadline, item):
+        """ Schedule `item` to expire at `deadline`. """
+        tick = int(deadline // self.resolution)
+        if self.current_tick is not None and tick < self.current_tick:
+            tick = self.current_tick
+        self.slots[tick % len(self.slots)].append((deadline, item))
+
+    def advance(self, now):
+        """ Move the wheel to `now` and return the items expired so far. """
+        tick = int(now // self.resolution)
+        if self.current_tick is None:
+            self.current_tick = tick
+        expired = []
+        last_tick = min(tick, self.current_tick + len(self.slots) - 1)
+        for i in range(self.current_tick, last_tick + 1):
+            slot = self.slots[i % len(self.slots)]
+            if not slot:
+                continue
+            remaining = []
+            for deadline, item in slot:
+                if deadline <= now:
+                    expired.append(item)
+                else:
+                    remaining.append((deadline, item))
+            slot[:] = remaining
+        self.current_tick = max(tick, self.current_tick)
+        return expired
+
+class StateExpirer:
+    """ Reset parsers which have been in progress for too long.
+
+    `timeouts` maps parser class names to the number of seconds a parser
+    may stay in progress, see `ParserBase.in_progress`. When a timeout is
+    hit, an `Incomplete Sequence` record is printed and only that parser is
+    reset. The record spans from the event which started the sequence to
+    its deadline, so it does not depend on which events reach the
+    expirer. A sequence still in progress when the trace ends is reported
+    as running `To: end of trace` instead, since its deadline has not
+    passed in the trace.
+    """
+
+    def __init__(self, active_parsers, shared_states, timeouts):
+        self.shared_states = shared_states
+        self.watched_parsers = [
+            (active_parser, timeouts[active_parser.__class__.__name__])
+            for active_parser in active_parsers
+            if active_parser.__class__.__name__ in timeouts
+        ]
+        self.wheel = TimerWheel()
+        self.armed = {}
+        self.reset_all_count = shared_states['reset_all_count']
+        self.event_time = None
+        self.now = None
+
+    def expire(self, timestamp):
+        """ Expire the parsers whose timeout passed before `timestamp`.
+
+        The clock never goes backwards. An event older than the latest one
+        leaves it where it is.
+        """
+        event_time = parse_timestamp(timestamp)
+        if event_time is None:
+            return
+        self.event_time = event_time
+        if self.now is None or event_time > self.now:
+            self.now = event_time
+
+        # All parsers are about to be reset anyway.
+        if self.shared_states['reset_all']:
+            self.armed.clear()
+
+        for active_parser, timer in self.wheel.advance(self.now):
+            if self.armed.get(active_parser) is not timer:
+                continue
+            del self.armed[active_parser]
+            if active_parser.in_progress():
+                start, deadline = timer
+                self._give_up(active_parser, start,
+                              format_timestamp(deadline, start))
+
+    def flush(self):
+        """ Give up every sequence still in progress at the end of the trace. """
+        if self.shared_states['reset_all']:
+            return
+        for active_parser, _ in self.watched_parsers:
+            timer = self.armed.pop(active_parser, None)
+            if timer is not None and active_parser.in_progress():
+                self._give_up(active_parser, timer[0], 'end of trace')
+
+    def _give_up(self, active_parser, start, end):
+        print('Incomplete Sequence $ Detector: %s, From: %s, To: %s'
+              % (active_parser.__class__.__name__, start, end))
+        active_parser.reset()
+
+    def arm(self, timestamp):
+        """ Start the timer of every parser which has just become in progress.
+
+        The deadline is counted from the time of the event at `timestamp`,
+        even if it is older than the clock.
+        """
+        if self.event_time is None:
+            return
+
+        # All parsers were reset in between, so any sequence in progress now
+        # is a new one.
+        if self.shared_states['reset_all_count'] != self.reset_all_count:
+            self.reset_all_count = self.shared_states['reset_all_count']
+            self.armed.clear()
+
+        for active_parser, timeout in self.watched_parsers:
+            if not active_parser.in_progress():
+                self.armed.pop(active_parser, None)
+            elif active_parser not in self.armed:
+                timer = (timestamp, self.event_time + timeout)
+                self.armed[active_parser] = timer
+                self.wheel.schedule(timer[1], (active_parser, timer))